@@ -0,0 +1,6 @@
+from setuptools import setup, Extension
+
+setup(
+    name="typist",
+    ext_modules=[Extension("_parsecsv", ["src/_parsecsv.c"])],
+)
@@ -0,0 +1,302 @@
+/*
+ * Fast parser for the delimited numeric tables read by typist.
+ *
+ * The file is mmap'ed and scanned with memchr for the row and field limits, the values
+ * are converted (as doubles, then float32 like pandas does) straight into a column-major float32 buffer (samples x genes),
+ * which typist wraps with numpy.frombuffer without copying. The pandas default NA values
+ * read as NaN.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <fcntl.h>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#define FIELD_MAX 64
+
+static const char *
+line_end(const char *p, const char *end)
+{
+    const char *nl = memchr(p, '\n', end - p);
+    return nl ? nl : end;
+}
+
+static const char *
+field_end(const char *p, const char *eol, char delim)
+{
+    const char *d = memchr(p, delim, eol - p);
+    return d ? d : eol;
+}
+
+static PyObject *
+field_str(const char *p, const char *q)
+{
+    if (q > p && q[-1] == '\r')
+        q--;
+    if (q - p >= 2 && *p == '"' && q[-1] == '"') {
+        p++;
+        q--;
+    }
+    return PyUnicode_DecodeUTF8(p, q - p, "replace");
+}
+
+static const double powers_of_ten[] = {
+    1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11,
+    1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22
+};
+
+/*
+ * Plain decimals (at most 19 digits, exponent within 1e22) are exact as a double
+ * mantissa times a power of ten, anything else goes through strtod.
+ */
+static int
+fast_decimal(const char *p, const char *q, double *out)
+{
+    unsigned long long mant = 0;
+    int digits = 0, exp10 = 0, neg = 0, seen = 0;
+
+    if (p < q && (*p == '-' || *p == '+'))
+        neg = (*p++ == '-');
+    for (; p < q && *p >= '0' && *p <= '9'; p++, seen = 1) {
+        if (mant || *p != '0')
+            digits++;
+        mant = mant * 10 + (unsigned)(*p - '0');
+    }
+    if (p < q && *p == '.') {
+        for (p++; p < q && *p >= '0' && *p <= '9'; p++, seen = 1) {
+            if (mant || *p != '0')
+                digits++;
+            mant = mant * 10 + (unsigned)(*p - '0');
+            exp10--;
+        }
+    }
+    if (!seen || p != q || digits > 19 || mant >> 53 || exp10 < -22)
+        return -1;
+    *out = (double)mant / powers_of_ten[-exp10];
+    if (neg)
+        *out = -*out;
+    return 0;
+}
+
+/* the default NA values of pandas.read_csv */
+static const char *const na_values[] = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null", NULL
+};
+
+static int
+is_na(const char *p, const char *q)
+{
+    const char *const *na;
+
+    if (q - p > 8)
+        return 0;
+    for (na = na_values; *na != NULL; na++)
+        if (strlen(*na) == (size_t)(q - p) && memcmp(*na, p, q - p) == 0)
+            return 1;
+    return 0;
+}
+
+static int
+parse_float(const char *p, const char *q, float *out)
+{
+    char buf[FIELD_MAX];
+    char *endptr;
+    double value;
+    size_t n;
+
+    if (q > p && q[-1] == '\r')
+        q--;
+    if (q - p >= 2 && *p == '"' && q[-1] == '"') {
+        p++;
+        q--;
+    }
+    if (is_na(p, q)) {
+        *out = NAN;
+        return 0;
+    }
+    while (p < q && *p == ' ')
+        p++;
+    while (q > p && q[-1] == ' ')
+        q--;
+    if (p == q) {
+        PyErr_SetString(PyExc_ValueError, "could not convert a blank field to float");
+        return -1;
+    }
+    if (fast_decimal(p, q, &value) == 0) {
+        *out = (float)value;
+        return 0;
+    }
+    n = (size_t)(q - p);
+    if (n >= FIELD_MAX) {
+        memcpy(buf, p, FIELD_MAX - 1);
+        buf[FIELD_MAX - 1] = '\0';
+        PyErr_Format(PyExc_ValueError, "could not convert string to float: '%s...'", buf);
+        return -1;
+    }
+    memcpy(buf, p, n);
+    buf[n] = '\0';
+    value = strtod(buf, &endptr);
+    /* strtod also reads hexadecimal floats, which pandas does not */
+    if (endptr == buf || *endptr != '\0' || strpbrk(buf, "xX") != NULL) {
+        PyErr_Format(PyExc_ValueError, "could not convert string to float: '%s'", buf);
+        return -1;
+    }
+    *out = (float)value;
+    return 0;
+}
+
+static PyObject *
+parse_lines(const char *start, const char *end, char delim)
+{
+    const char *p, *eol, *q, *body;
+    PyObject *index_name = NULL, *colnames = NULL, *rownames = NULL, *data = NULL, *name;
+    Py_ssize_t ncols = 0, nrows = 0, row, col, line;
+    float *values;
+
+    /* header: index name followed by the column names */
+    eol = line_end(start, end);
+    colnames = PyList_New(0);
+    if (colnames == NULL)
+        goto error;
+    for (p = start;; p = q + 1) {
+        q = field_end(p, eol, delim);
+        name = field_str(p, q);
+        if (name == NULL)
+            goto error;
+        if (index_name == NULL) {
+            index_name = name;
+        } else {
+            if (PyList_Append(colnames, name) < 0) {
+                Py_DECREF(name);
+                goto error;
+            }
+            Py_DECREF(name);
+        }
+        if (q == eol)
+            break;
+    }
+    ncols = PyList_GET_SIZE(colnames);
+    body = eol < end ? eol + 1 : end;
+
+    /* first sweep: count the data rows */
+    for (p = body; p < end; p = eol + 1) {
+        eol = line_end(p, end);
+        if (eol > p && !(eol - p == 1 && *p == '\r'))
+            nrows++;
+        if (eol == end)
+            break;
+    }
+
+    rownames = PyList_New(nrows);
+    data = PyBytes_FromStringAndSize(NULL, nrows * ncols * (Py_ssize_t)sizeof(float));
+    if (rownames == NULL || data == NULL)
+        goto error;
+    values = (float *)PyBytes_AS_STRING(data);
+
+    /* second sweep: row names and values, stored column by column */
+    row = 0;
+    line = 1;
+    for (p = body; p < end && row < nrows; p = eol + 1) {
+        eol = line_end(p, end);
+        line++;
+        if (eol == p || (eol - p == 1 && *p == '\r'))
+            continue;
+        q = field_end(p, eol, delim);
+        name = field_str(p, q);
+        if (name == NULL)
+            goto error;
+        PyList_SET_ITEM(rownames, row, name);
+        for (col = 0; col < ncols; col++) {
+            if (q == eol) {
+                values[col * nrows + row] = NAN;
+                continue;
+            }
+            p = q + 1;
+            q = field_end(p, eol, delim);
+            if (parse_float(p, q, &values[col * nrows + row]) < 0)
+                goto error;
+        }
+        if (q != eol) {
+            PyErr_Format(PyExc_ValueError, "Expected %zd fields in line %zd, saw more",
+                         ncols + 1, line);
+            goto error;
+        }
+        row++;
+    }
+
+    return Py_BuildValue("(NNNN)", index_name, rownames, colnames, data);
+
+error:
+    Py_XDECREF(index_name);
+    Py_XDECREF(colnames);
+    Py_XDECREF(rownames);
+    Py_XDECREF(data);
+    return NULL;
+}
+
+static PyObject *
+parse_matrix(PyObject *self, PyObject *args)
+{
+    const char *path, *delim;
+    Py_ssize_t delim_len;
+    struct stat st;
+    int fd;
+    void *map;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "ss#", &path, &delim, &delim_len))
+        return NULL;
+    if (delim_len != 1) {
+        PyErr_SetString(PyExc_ValueError, "delimiter must be a single character");
+        return NULL;
+    }
+
+    fd = open(path, O_RDONLY);
+    if (fd < 0 || fstat(fd, &st) < 0) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        if (fd >= 0)
+            close(fd);
+        return NULL;
+    }
+    if (st.st_size == 0) {
+        close(fd);
+        PyErr_Format(PyExc_ValueError, "empty file: %s", path);
+        return NULL;
+    }
+    map = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (map == MAP_FAILED) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        return NULL;
+    }
+    madvise(map, st.st_size, MADV_SEQUENTIAL);
+
+    result = parse_lines((const char *)map, (const char *)map + st.st_size, delim[0]);
+    munmap(map, st.st_size);
+    return result;
+}
+
+static PyMethodDef parsecsv_methods[] = {
+    {"parse_matrix", parse_matrix, METH_VARARGS,
+     "parse_matrix(path, delim) -> (index_name, rownames, colnames, data)\n\n"
+     "Parses a delimited table of floats. data holds the float32 values column by column\n"
+     "(len(colnames) x len(rownames))."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef parsecsv_module = {
+    PyModuleDef_HEAD_INIT, "_parsecsv", "Fast float table parser for typist.", -1, parsecsv_methods
+};
+
+PyMODINIT_FUNC
+PyInit__parsecsv(void)
+{
+    return PyModule_Create(&parsecsv_module);
+}
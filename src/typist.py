@@ -1,69 +1,288 @@
 #!/usr/bin/env python3
 
-import csv
+import os
+import json
 import logging
 import argparse
+import importlib.util
+from collections import defaultdict
 
-def get_markers(file, delim):    
+try:
+    from _parsecsv import parse_matrix
+except ImportError:
+    parse_matrix = None
+
+# the default NA values of pandas.read_csv, also read as NaN by _parsecsv and scan_expressions
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+def has_duplicate_columns(file, delim):
+    """
+    Checks whether the header of a CSV/TSV table has duplicated column names.
+
+    Parameters:
+        file (str): The name of the file to be checked.
+        delim (str): The delimiter used in the file.
+
+    Returns:
+        bool: True if a column name appears more than once.
+    """
+    with open(file, newline='') as f:
+        names = [name.strip('"') for name in f.readline().rstrip("\r\n").split(delim)]
+    return len(set(names)) < len(names)
+
+def read_table(file, delim, file_format="tsv"):
+    """
+    Reads a CSV/TSV table with the pandas C parser, or a Parquet table with pyarrow.
+
+    The first column is used as the (string) row index and all the other columns are
+    parsed as float32 values. When the _parsecsv extension is built, CSV/TSV tables are
+    parsed with it instead of pandas, unless their header has duplicated names (which
+    pandas renames).
+
+    Parameters:
+        file (str): The name of the file to be read.
+        delim (str): The delimiter used in the file.
+        file_format (str): The file format, one of "csv", "tsv" or "parquet".
+
+    Returns:
+        DataFrame: A table with rows indexed by the first column.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        df = pq.read_table(file).to_pandas(self_destruct=True)
+        if isinstance(df.index, pd.RangeIndex):
+            df = df.set_index(df.columns[0])
+        df = df.astype(np.float32)
+    elif parse_matrix is not None and len(delim) == 1 and not has_duplicate_columns(file, delim):
+        index_name, rownames, colnames, data = parse_matrix(file, delim)
+        values = np.frombuffer(data, dtype=np.float32).reshape(len(colnames), len(rownames)).T
+        df = pd.DataFrame(values, index=pd.Index(rownames, name=index_name), columns=colnames, copy=False)
+    else:
+        index_col = pd.read_csv(file, sep=delim, nrows=0).columns[0]
+        dtypes = defaultdict(lambda: np.float32, {index_col: str})
+        df = pd.read_csv(file, sep=delim, index_col=0, dtype=dtypes, engine='c')
+    df.columns = df.columns.str.strip()
+    return df
+
+def convert_table(file, delim):
     """
-    Reads a gene markers file and returns a dictionary of markers and a list of category names.
+    Converts a CSV/TSV table to Parquet, so later runs can skip the text parsing.
+
+    An existing Parquet file newer than the table is reused as is, which also keeps the
+    binary cache of a converted expression file valid across runs.
+
+    Parameters:
+        file (str): The name of the file to be converted.
+        delim (str): The delimiter used in the file.
+
+    Returns:
+        str: The name of the Parquet file, next to the original file.
+    """
+    parquet_file = os.path.splitext(file)[0] + ".parquet"
+    if os.path.exists(parquet_file) and os.stat(parquet_file).st_mtime_ns >= os.stat(file).st_mtime_ns:
+        logging.debug("Using the existing %s", parquet_file)
+        return parquet_file
+    logging.debug("Converting %s to %s", file, parquet_file)
+    read_table(file, delim).to_parquet(parquet_file)
+    return parquet_file
+
+def get_markers(file, delim, file_format="tsv"):    
+    """
+    Reads a gene markers file and returns a table of markers and a list of category names.
     
     The file is expected to be a CSV/TSV file with the first column being the gene
     marker and the first row containing the category names. The other columns are values
-    associated with each marker (1 for expressed, 0 for non expressed).
+    associated with each marker (1 for expressed, 0 for non expressed). Markers with
+    integer values in the int8 range (like the 0/1 markers) are stored as int8, weighted
+    markers are kept as float32.
     
     Parameters:
         file (str): The name of the file to be read.
         delim (str): The delimiter used in the file.
+        file_format (str): The file format, one of "csv", "tsv" or "parquet".
     
     Returns:
-        tuple: A tuple where the first element is a dictionary of markers and their
-        associated values, the maximal scores per category and the second element is a list of
-        categories names.
+        tuple: A tuple where the first element is an int8 or float32 array of markers (genes x categories),
+        the second the gene index of the markers, the third the maximal scores per category and
+        the fourth element is a list of categories names.
     """
-    markers = {}
-    max_score = {}
+    import numpy as np
+
     logging.debug("Reading markers file %s", file)
-    with open(file, 'r') as f:
-        reader = csv.reader(f, delimiter=delim)
-        colnames = [colname.strip() for colname in next(reader)]
-        for col in colnames:
-            max_score[col] = 0
-
-        for row in reader:
-            gen = row[0]
-            markers[gen] = {}
-            for col in range(1, len(row)):
-                markers[gen][colnames[col]] = float(row[col])
-                max_score[colnames[col]] += float(row[col])
-    colnames.pop(0)
-
-    logging.debug("Found markers: %s", str(len(markers)))
+    markers = read_table(file, delim, file_format)
+    values = markers.to_numpy()
+    max_score = values.sum(axis=0, dtype=np.float64)
+    unique = ~markers.index.duplicated(keep='last')
+    if not unique.all():
+        values = values[unique]
+    marker_genes = markers.index[unique]
+    colnames = markers.columns.tolist()
+
+    logging.debug("Found markers: %s", str(len(marker_genes)))
     logging.debug("Found categories: %s", colnames)
     
-    return markers, max_score, colnames
+    if values.size and values.min() >= -128 and values.max() <= 127 and np.array_equal(values, np.rint(values)):
+        values = values.astype(np.int8)
+    return values, marker_genes, max_score, colnames
 
-def cpm_normalization(expressions):
+def cpm_normalization(arr):
     """
-    Normalizes expression data to counts per million (CPM).
+    Normalizes expression data to counts per million (CPM), in place.
     
     Parameters:
-        expressions (dict): A dictionary where keys are gene names and values are expression values.
+        arr (ndarray): A float array of expression values (genes x samples).
     
     Returns:
-        dict: A dictionary where keys are gene names and values are normalized expression values.
+        ndarray: The array of normalized expression values (genes x samples).
     """
+    import numpy as np
+
     logging.debug("Normalizing expression data")
-    cpm = {}
-    for sample in expressions:
-        total = sum(expressions[sample].values())
-        for gene in expressions[sample]:
-            cpm[sample][gene] = expressions[sample][gene] / total * 1000000
-    return cpm
+    if not arr.flags.writeable:
+        arr = arr.copy()
+    totals = arr.sum(axis=0, dtype=np.float64, keepdims=True)
+    np.multiply(arr, 1000000 / totals, out=arr, casting="same_kind")
+    return arr
 
-def get_expressions(file, delim, min_expr, cpm_norm, average_filter):
+def scan_expressions(file, delim, min_expr, cpm_norm, average_filter, file_format="tsv"):
     """
-    Reads an expression file and returns a dictionary of expressions and a list of sample names.
+    Streams an expression file with Polars and returns the filtered expressions.
+
+    The normalization and the filters are pushed into a lazy query, so only the 0/1 matrix
+    is materialized.
+
+    Parameters:
+        file (str): The name of the file to be read.
+        delim (str): The delimiter used in the file.
+        min_expr (float): The minimum expression value, below which a value is considered 0.
+        cpm_norm (bool): If True, normalize the expression values to CPM.
+        average_filter (bool): If True, filter the expression values by average expression in each sample.
+        file_format (str): The file format, one of "csv", "tsv" or "parquet".
+
+    Returns:
+        tuple: A tuple where the first element is a 0/1 uint8 array of filtered expressions
+        (genes x samples), the second element is the gene index and the third element is a
+        list of sample names.
+    """
+    import pandas as pd
+    import polars as pl
+
+    logging.debug("Scanning expressions file %s", file)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        lf = pl.scan_parquet(file)
+        # Parquet files written by pandas keep the gene index as one of their last columns
+        metadata = pq.read_schema(file).pandas_metadata or {}
+        index_columns = [name for name in metadata.get("index_columns", []) if isinstance(name, str)]
+    else:
+        lf = pl.scan_csv(file, separator=delim, has_header=True, infer_schema=False, null_values=NA_VALUES)
+        index_columns = []
+    schema = lf.collect_schema()
+    gene_col = index_columns[0] if index_columns else schema.names()[0]
+    names = [name for name in schema.names() if name != gene_col]
+    colnames = [name.strip() for name in names]
+    lf = lf.rename(dict(zip(names, colnames)))
+    values = pl.col(colnames)
+    if file_format != "parquet":
+        # the CSV values are read as strings, pandas ignores the spaces around them
+        values = values.str.strip_chars(" ")
+    lf = lf.with_columns(values.cast(pl.Float32).fill_null(float("nan")))
+    lf = lf.unique(subset=gene_col, keep="last", maintain_order=True)
+
+    logging.debug("Found samples: %s", colnames)
+
+    values = [pl.col(col) for col in colnames]
+    if cpm_norm:
+        logging.debug("Normalizing expression data")
+        values = [value.cast(pl.Float64) / value.cast(pl.Float64).sum() * 1000000 for value in values]
+
+    # Polars sorts NaN above every number, NumPy never counts it as expressed
+    if average_filter:
+        logging.debug("Filtering by average expression")
+        values = [((value >= value.mean()) & value.is_not_nan()).cast(pl.UInt8).alias(col) for value, col in zip(values, colnames)]
+    else:
+        logging.debug("Filtering by minimum expression")
+        values = [((value >= min_expr) & value.is_not_nan()).cast(pl.UInt8).alias(col) for value, col in zip(values, colnames)]
+
+    df = lf.select(pl.col(gene_col), *values).collect(engine="streaming")
+    logging.debug("Found genes per sample: %s", str(df.height))
+
+    return df.select(colnames).to_numpy(), pd.Index(df[gene_col].to_list()), colnames
+
+def read_cache(cache_bin, file, delim, file_format="tsv"):
+    """
+    Memory-maps a binary cache of an expression table.
+
+    The cache is the float32 matrix written column by column (samples x genes), with a JSON
+    sidecar holding the shape, the gene and sample names, the size and modification time
+    of the source file and the delimiter and format it was read with.
+
+    Parameters:
+        cache_bin (str): The name of the binary cache file.
+        file (str): The name of the source expression file.
+        delim (str): The delimiter used in the file.
+        file_format (str): The file format, one of "csv", "tsv" or "parquet".
+
+    Returns:
+        tuple: A tuple with the read-only expressions array (genes x samples), the gene
+        index and the list of sample names, or None if the cache is missing or stale.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not (os.path.exists(cache_bin) and os.path.exists(cache_bin + ".json")):
+        return None
+    with open(cache_bin + ".json") as f:
+        meta = json.load(f)
+    stat = os.stat(file)
+    if (meta["source"] != [os.path.abspath(file), stat.st_size, stat.st_mtime_ns]
+            or meta.get("delimiter") != delim or meta.get("format") != file_format):
+        logging.debug("Cache %s is stale", cache_bin)
+        return None
+    logging.debug("Loading expressions cache %s", cache_bin)
+    genes, samples = meta["genes"], meta["samples"]
+    arr = np.memmap(cache_bin, dtype=np.float32, mode='r', shape=(len(samples), len(genes))).T
+    return arr, pd.Index(genes, name=meta["index_name"]), samples
+
+def write_cache(cache_bin, file, delim, file_format, arr, genes, samples):
+    """
+    Writes the binary cache of an expression table (see read_cache).
+
+    Parameters:
+        cache_bin (str): The name of the binary cache file.
+        file (str): The name of the source expression file.
+        delim (str): The delimiter used in the file.
+        file_format (str): The file format, one of "csv", "tsv" or "parquet".
+        arr (ndarray): The float32 expressions array (genes x samples).
+        genes (Index): The gene index.
+        samples (list): The list of sample names.
+    """
+    import numpy as np
+
+    logging.debug("Writing expressions cache %s", cache_bin)
+    np.asfortranarray(arr, dtype=np.float32).T.tofile(cache_bin)
+    stat = os.stat(file)
+    meta = {
+        "shape": list(arr.shape),
+        "index_name": genes.name,
+        "genes": genes.tolist(),
+        "samples": samples,
+        "source": [os.path.abspath(file), stat.st_size, stat.st_mtime_ns],
+        "delimiter": delim,
+        "format": file_format,
+    }
+    with open(cache_bin + ".json", 'w') as f:
+        json.dump(meta, f)
+
+def get_expressions(file, delim, min_expr, cpm_norm, average_filter, file_format="tsv", lazy=False, use_numba=False, cache_bin=None):
+    """
+    Reads an expression file and returns a table of expressions and a list of sample names.
     
     The file is expected to be a CSV/TSV file with the first column being the gene and the 
     first row containing the sample names. The other columns are valuesassociated with each gene
@@ -75,99 +294,221 @@ def get_expressions(file, delim, min_expr, cpm_norm, average_filter):
         min_expr (float): The minimum expression value, below which a value is considered 0.
         no_norm (bool): If True, do not normalize the expression values.
         average_filter (bool): If True, filter the expression values by average expression in each sample.
+        file_format (str): The file format, one of "csv", "tsv" or "parquet".
+        lazy (bool): If True, stream the file with Polars (see scan_expressions).
+        use_numba (bool): If True, normalize and filter in one pass with the Numba kernel.
+        cache_bin (str): If set, memory-map the expressions from this binary cache, writing
+            it first when it is missing or older than the file. Not used when lazy is set.
     
     Returns:
-        tuple: A tuple where the first element is a dictionary of expressions and their
-        associated values, and the second element is a list of sample names.
+        tuple: A tuple where the first element is a 0/1 uint8 array of filtered expressions
+        (genes x samples), the second element is the gene index and the third element is a
+        list of sample names.
     """
-    logging.debug("Reading expressions file %s", file)
-    expressions = {}
+    import numpy as np
 
-    with open(file, 'r') as f:
-        reader = csv.reader(f, delimiter=delim)
-        colnames = [colname.strip() for colname in next(reader)]
-        for col in range(1, len(colnames)):
-            expressions[colnames[col]] = {}
+    if lazy:
+        return scan_expressions(file, delim, min_expr, cpm_norm, average_filter, file_format)
 
-        for row in reader:
-            gen = row[0]
-            for col in range(1, len(row)):
-                expressions[colnames[col]][gen] = float(row[col])
-
-        colnames.pop(0)
+    cached = read_cache(cache_bin, file, delim, file_format) if cache_bin else None
+    if cached:
+        arr, genes, colnames = cached
+    else:
+        logging.debug("Reading expressions file %s", file)
+        expressions = read_table(file, delim, file_format)
+        unique = ~expressions.index.duplicated(keep='last')
+        if not unique.all():
+            expressions = expressions[unique]
+        arr, genes, colnames = expressions.to_numpy(), expressions.index, expressions.columns.tolist()
+        if cache_bin:
+            write_cache(cache_bin, file, delim, file_format, arr, genes, colnames)
     
     logging.debug("Found samples: %s", colnames)
-    logging.debug("Found genes per sample: %s", str(len(expressions[colnames[0]])))
+    logging.debug("Found genes per sample: %s", str(len(genes)))
+
+    if use_numba:
+        from typist_kernels import normalize_and_mask
+        logging.debug("Normalizing and filtering expression data")
+        mask = normalize_and_mask(np.asfortranarray(arr), min_expr, average_filter, cpm_norm)
+        return mask, genes, colnames
 
     if cpm_norm:
-        expressions = cpm_normalization(expressions)
+        arr = cpm_normalization(arr)
     
     if average_filter:
         logging.debug("Filtering by average expression")
-        for sample in expressions:
-            avg = sum(expressions[sample].values()) / len(expressions[sample])
-            for gene in expressions[sample]:
-                if expressions[sample][gene] < avg:
-                    expressions[sample][gene] = 0
-                else:
-                    expressions[sample][gene] = 1
-        return expressions, colnames
-
+        mask = arr >= arr.mean(axis=0, dtype=np.float64, keepdims=True)
     else:
         logging.debug("Filtering by minimum expression")
-        for sample in expressions:
-            for gene in expressions[sample]:
-                if expressions[sample][gene] < min_expr:
-                    expressions[sample][gene] = 0
-                else:
-                    expressions[sample][gene] = 1
-        return expressions, colnames
+        mask = arr >= min_expr
+    return mask.astype(np.uint8), genes, colnames
+
+
+def pack_columns(mask):
+    """
+    Packs the columns of a 0/1 matrix into 64 bits words.
+
+    Parameters:
+        mask (ndarray): A 0/1 array (genes x columns).
+
+    Returns:
+        ndarray: A uint64 array (columns x words) with 64 genes per word.
+    """
+    import numpy as np
+
+    bits = np.packbits(mask.T, axis=1)
+    pad = -bits.shape[1] % 8
+    if pad:
+        bits = np.pad(bits, ((0, 0), (0, pad)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+def popcount_scores(expr_bits, marker_bits):
+    """
+    Counts the genes set in both a sample and a category for packed 0/1 matrices.
+
+    Parameters:
+        expr_bits (ndarray): The packed expressions (samples x words).
+        marker_bits (ndarray): The packed markers (categories x words).
+
+    Returns:
+        ndarray: The number of shared genes (samples x categories).
+    """
+    import numpy as np
+
+    scores = np.empty((expr_bits.shape[0], marker_bits.shape[0]), dtype=np.float32)
+    for col in range(marker_bits.shape[0]):
+        scores[:, col] = np.bitwise_count(expr_bits & marker_bits[col]).sum(axis=1)
+    return scores
+
+def parallel_rows(func, rows, other, threads=None):
+    """
+    Applies a scoring function to chunks of rows in a thread pool and stacks the results.
+
+    NumPy releases the GIL in the matrix products and the popcounts, so the chunks of samples
+    are scored in parallel.
 
+    Parameters:
+        func (callable): The scoring function, called as func(chunk, other).
+        rows (ndarray): The per sample rows (samples x genes or words).
+        other (ndarray): The second operand, shared by all the chunks.
+        threads (int): The number of threads, all the CPUs by default.
+
+    Returns:
+        ndarray: The stacked scores (samples x categories).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import repeat
+    import numpy as np
+
+    threads = threads or os.cpu_count() or 1
+    chunk = max(256, -(-len(rows) // threads))
+    if threads == 1 or len(rows) <= chunk:
+        return func(rows, other)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        parts = pool.map(func, [rows[i:i + chunk] for i in range(0, len(rows), chunk)], repeat(other))
+        return np.vstack(list(parts))
 
-def get_predictions(expressions, samples, markers, max_scores, categ):
+def weighted_scores(expressed, markers):
+    """
+    Computes the scores of weighted markers as matrix products.
+
+    Parameters:
+        expressed (ndarray): A 0/1 float32 array of expressions (samples x genes).
+        markers (ndarray): A float32 array of markers (genes x categories).
+
+    Returns:
+        ndarray: The scores (samples x categories).
+    """
+    import numpy as np
+
+    scores = np.dot(expressed, np.where(markers <= 1, markers, 0))
+    if (markers < 0).any():
+        scores += np.dot(1 - expressed, np.where(markers <= 0, markers, 0))
+    return scores
+
+def get_predictions(expressions, genes, samples, markers, marker_genes, max_scores, categ, use_numba=False, threads=None):
     """
     Makes predictions based on expression data.
 
+    A marker value is added to the score of a category when the (0/1) expression of the gene
+    is greater or equal than the marker value, so the scores are computed as two matrix
+    products over the genes shared by both tables: expressed genes take the markers <= 1 and
+    non expressed genes take the markers <= 0. When all markers are 0/1 the scores are just
+    the number of genes set in both tables, counted over bit-packed columns. The scores are
+    divided by the maximal score of their category, categories with a zero maximal score are
+    scored 0.
+
     Parameters:
-        expressions (dict): A dictionary of gene expression data, where keys are gene names and values are dictionaries of sample names and expression values.
+        expressions (ndarray): A 0/1 array of filtered gene expression data (genes x samples).
+        genes (Index): The gene names of the expression rows.
         samples (list): A list of sample names.
-        markers (dict): A dictionary of gene markers, where keys are gene names and values are dictionaries of category names and marker values.
+        markers (ndarray): An int8 or float32 array of gene markers (genes x categories).
+        marker_genes (Index): The gene names of the marker rows.
+        max_scores (ndarray): The maximal score per category.
         categ (list): A list of category names.
+        use_numba (bool): If True, compute the scores with the Numba kernel.
+        threads (int): The number of threads of the NumPy scoring, all the CPUs by default
+            (the Numba kernels use the thread count set with numba.set_num_threads).
 
     Returns:
-        dict: A dictionary of predictions, where keys are sample names and values are dictionaries of category names and prediction values.
+        ndarray: The prediction scores (samples x categories).
     """
+    import numpy as np
+
     logging.debug("Making predictions")
-    predicts = {}
-    for sample in samples:
-        predicts[sample] = {}
-        total_markers = 0
-        for category in categ:
-            predicts[sample][category] = 0
-        for gene in expressions[sample]:
-            if gene in markers:
-                total_markers += 1
-                for category in categ:
-                    if expressions[sample][gene] >= markers[gene][category]:
-                        predicts[sample][category] += markers[gene][category]
-        
-        for category in categ:
-            if total_markers > 0:
-                predicts[sample][category] = predicts[sample][category] / max_scores[category]
-            else:
-                logging.error("No markers found for sample %s", sample)
-    return predicts
+    common = genes.intersection(marker_genes)
+    expressed = expressions.T.take(genes.get_indexer(common), axis=1)
+    markers = markers.take(marker_genes.get_indexer(common), axis=0)
+
+    if use_numba:
+        from typist_kernels import predict_padded
+        scores = predict_padded(np.ascontiguousarray(expressed), np.ascontiguousarray(markers))
+    elif hasattr(np, "bitwise_count") and ((markers == 0) | (markers == 1)).all():
+        scores = parallel_rows(popcount_scores, pack_columns(expressed.T), pack_columns(markers.astype(np.uint8)), threads)
+    else:
+        scores = parallel_rows(weighted_scores, expressed.astype(np.float32), markers.astype(np.float32), threads)
+
+    if len(common) > 0:
+        zero = max_scores == 0
+        if zero.any():
+            logging.warning("Categories with a zero maximal score, scored 0: %s", ", ".join(str(c) for c, z in zip(categ, zero) if z))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(zero, 0.0, scores / max_scores)
+    else:
+        logging.error("No markers found for samples %s", ", ".join(map(str, samples)))
+    return scores
                     
 
+def positive_int(value):
+    """
+    Parses a strictly positive integer command line argument.
+
+    Parameters:
+        value (str): The argument value.
+
+    Returns:
+        int: The parsed value.
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("%s is not a positive integer" % value)
+    return number
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--input_file", required=True, help="input file")
     parser.add_argument("-g", "--genemarkers_file", required=True, help="gene markers file")
     parser.add_argument("-o", "--output_file", required=True, help="output file")
-    parser.add_argument("-d", "--delimiter", default="\t", help="field delimiter")
+    parser.add_argument("-d", "--delimiter", help="field delimiter (tab by default, comma for csv)")
+    parser.add_argument("-f", "--format", choices=["csv", "tsv", "parquet"], default="tsv", help="input files format")
+    parser.add_argument("-w", "--write_parquet", action="store_true", help="convert the input files to Parquet for later runs")
+    parser.add_argument("-c", "--cache_bin", help="binary cache of the input file, memory-mapped on later runs")
+    parser.add_argument("-l", "--lazy", action="store_true", help="stream the expression file with Polars")
     parser.add_argument("-m", "--min_expression", type=float, default=0.0, help="filter by minimum expression value")
     parser.add_argument("-a", "--average_filter", action="store_true", help="use average expression filter")
     parser.add_argument("-n", "--cpm_normalization", action="store_true", help="use normalization (CPM by default)")
+    parser.add_argument("-t", "--threads", type=positive_int, help="number of threads, a positive integer (all CPUs by default); BLAS, used with weighted markers, keeps its own thread settings")
+    parser.add_argument("-u", "--use_numba", action="store_true", help="use the Numba filtering and prediction kernels")
     parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
     args = parser.parse_args()
 
@@ -175,9 +516,15 @@ def main():
     genemarkers_file = args.genemarkers_file
     output_file = args.output_file
     delimiter = args.delimiter
+    file_format = args.format
+    write_parquet = args.write_parquet
+    cache_bin = args.cache_bin
+    lazy = args.lazy
     min_expression = args.min_expression
     cpm_normalization = args.cpm_normalization
     average_filter = args.average_filter
+    use_numba = args.use_numba
+    threads = args.threads
     verbose = args.verbose
 
     if verbose:
@@ -185,22 +532,37 @@ def main():
     else:
         logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-    markers, max_scores, categ = get_markers(genemarkers_file, delimiter)
+    if use_numba and importlib.util.find_spec("numba") is None:
+        logging.warning("Numba is not installed, using NumPy instead")
+        use_numba = False
+
+    if use_numba and threads:
+        import numba
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+
+    if lazy and cache_bin:
+        logging.warning("The binary cache is not used with --lazy, ignoring %s", cache_bin)
+        cache_bin = None
+
+    if delimiter is None:
+        delimiter = "," if file_format == "csv" else "\t"
 
-    expressions, samples = get_expressions(input_file, delimiter, min_expression, cpm_normalization, average_filter)
+    if write_parquet and file_format != "parquet":
+        genemarkers_file = convert_table(genemarkers_file, delimiter)
+        input_file = convert_table(input_file, delimiter)
+        file_format = "parquet"
 
-    predictions = get_predictions(expressions, samples, markers, max_scores, categ)
+    markers, marker_genes, max_scores, categ = get_markers(genemarkers_file, delimiter, file_format)
+
+    expressions, genes, samples = get_expressions(input_file, delimiter, min_expression, cpm_normalization, average_filter, file_format, lazy, use_numba, cache_bin)
+
+    predictions = get_predictions(expressions, genes, samples, markers, marker_genes, max_scores, categ, use_numba, threads)
+
+    import pandas as pd
 
     logging.debug("Writing predictions to file %s", output_file)
-    with open(output_file, 'w') as out:
-        writer = csv.writer(out, delimiter=delimiter)
-        writer.writerow(["Sample"] + categ)
-        for sample in predictions:
-            row = [sample]
-            for category in categ:
-                row.append("%.4f" % predictions[sample][category])
-            writer.writerow(row)
-        
+    pd.DataFrame(predictions, index=samples, columns=categ).to_csv(output_file, sep=delimiter, index_label="Sample", float_format="%.4f", lineterminator="\r\n")
+
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from numba import njit, prange
+
+SAMPLE_BLOCK = 64
+GENE_BLOCK = 512
+CATEGORY_WIDTH = 4
+
+@njit(parallel=True, fastmath=True, cache=True)
+def predict(expr, markers):
+    """
+    Computes the raw category scores with explicit loops (Numba kernel).
+
+    A marker value is added to the score when the expression of the gene is greater or
+    equal than the marker value. The samples are scored in blocks of SAMPLE_BLOCK, walking
+    the genes in tiles of GENE_BLOCK, so each tile of markers is reused from L1 by the whole
+    block instead of being streamed again for every sample.
+
+    Parameters:
+        expr (ndarray): A contiguous 0/1 uint8 array of expressions (samples x genes).
+        markers (ndarray): A contiguous int8 or float32 array of markers (genes x categories).
+
+    Returns:
+        ndarray: The scores (samples x categories).
+    """
+    S, G = expr.shape
+    C = markers.shape[1]
+    out = np.empty((S, C), np.float32)
+    for b in prange((S + SAMPLE_BLOCK - 1) // SAMPLE_BLOCK):
+        s0 = b * SAMPLE_BLOCK
+        s1 = min(s0 + SAMPLE_BLOCK, S)
+        acc = np.zeros((s1 - s0, C), np.float64)
+        for g0 in range(0, G, GENE_BLOCK):
+            g1 = min(g0 + GENE_BLOCK, G)
+            for s in range(s0, s1):
+                for g in range(g0, g1):
+                    e = expr[s, g]
+                    for c in range(C):
+                        m = markers[g, c]
+                        acc[s - s0, c] += m if e >= m else 0
+        for s in range(s0, s1):
+            for c in range(C):
+                out[s, c] = acc[s - s0, c]
+    return out
+
+def predict_padded(expr, markers):
+    """
+    Computes the raw category scores with the predict kernel, padding the categories.
+
+    Numba compiles the kernel per dtype and layout only, so the number of categories is a
+    runtime value. LLVM vectorizes the inner loop over the categories by CATEGORY_WIDTH (the
+    float64 accumulators in a 256 bits vector) and finishes with a scalar remainder loop,
+    which is skipped when the number of categories is a multiple of that width. The markers
+    get zero columns up to it; a zero marker never adds to the score and the extra columns
+    are dropped afterwards. A single category is left alone, as padding it to the full
+    width measured slower than the scalar loop.
+
+    Parameters:
+        expr (ndarray): A contiguous 0/1 uint8 array of expressions (samples x genes).
+        markers (ndarray): A contiguous int8 or float32 array of markers (genes x categories).
+
+    Returns:
+        ndarray: The scores (samples x categories).
+    """
+    C = markers.shape[1]
+    width = -(-C // CATEGORY_WIDTH) * CATEGORY_WIDTH
+    if C <= 1 or width == C:
+        return predict(expr, markers)
+    padded = np.zeros((markers.shape[0], width), markers.dtype)
+    padded[:, :C] = markers
+    return predict(expr, padded)[:, :C]
+
+@njit(parallel=True, error_model="numpy", cache=True)
+def normalize_and_mask(arr, min_expr, average_filter, cpm_norm):
+    """
+    Normalizes and filters the expressions in a single sweep per sample (Numba kernel).
+
+    Each sample column is summed, scaled to CPM (if requested) and compared against its
+    average or the minimum expression while it is still in cache. The minimum expression is
+    rounded to float32 first, as NumPy does when comparing the float32 array to a scalar.
+
+    Parameters:
+        arr (ndarray): A float32 array of expression values (genes x samples).
+        min_expr (float): The minimum expression value, below which a value is considered 0.
+        average_filter (bool): If True, filter by the average expression in each sample.
+        cpm_norm (bool): If True, normalize the expression values to CPM.
+
+    Returns:
+        ndarray: A 0/1 uint8 array of filtered expressions (genes x samples).
+    """
+    G, S = arr.shape
+    out = np.empty((S, G), np.uint8).T
+    for s in prange(S):
+        scale = 1.0
+        if cpm_norm:
+            total = 0.0
+            for g in range(G):
+                total += arr[g, s]
+            scale = 1000000 / total
+        thr = np.float64(np.float32(min_expr))
+        if average_filter:
+            acc = 0.0
+            for g in range(G):
+                acc += np.float32(arr[g, s] * scale)
+            thr = acc / G
+        for g in range(G):
+            out[g, s] = 1 if np.float32(arr[g, s] * scale) >= thr else 0
+    return out